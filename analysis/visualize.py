@@ -1,121 +1,171 @@
 import argparse
-import json
-import math
+import io
+import itertools
 from pathlib import Path
 
 import numpy as np
-import matplotlib.pyplot as plt
+import orjson
 import pandas as pd
 import requests
+import matplotlib
 
+# Only PNGs are saved, so skip loading an interactive GUI backend
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
 
-def main(stats_json_uri: str, out_directory: str):
-    # Initialize directory to save visualizations to
-    out_directory = Path(out_directory)
-    out_directory.mkdir(exist_ok=True)
+# Experiment fields required for the visualizations
+COLUMNS = (
+    "evaluation_start_unixtimes",
+    "evaluation_durations_s",
+    "next_evaluation_unixtime",
+    "evaluation_time_interval_h",
+    "payload_size_b",
+)
 
-    # Load JSON with experimental results from HTTP or disk
-    if stats_json_uri.startswith("http"):
-        r = requests.get(stats_json_uri)
-        experiments = json.loads(r.content.decode()).values()
-    else:
-        experiments = json.loads(Path(stats_json_uri).read_text()).values()
-    df = pd.DataFrame(experiments)
 
-    # Calculate current experiment lifetime from first and last evaluation
-    df["lifetime_s"] = df.apply(
-        lambda r: (
-            r["evaluation_start_unixtimes"][-1]
-            - r["evaluation_start_unixtimes"][0]
-            + r["evaluation_durations_s"][-1]
-            if len(r["evaluation_start_unixtimes"]) > 1
-            else None
-        ),
-        axis=1,
-    )
-    df["lifetime_h"] = df["lifetime_s"] / 60 / 60
-    df["lifetime_d"] = df["lifetime_h"] / 24
-    df["payload_size_kib"] = df["payload_size_b"] / 1024
+def parse_experiments_log(log: bytes) -> dict:
+    # Later records in the append-only log supersede earlier ones, and a final
+    # record without a trailing newline was torn by a crash mid-append
+    experiments = {}
+    for record in log.split(b"\n")[:-1]:
+        e = orjson.loads(record)
+        experiments[e["dht_record_key"]] = e
+    return experiments
 
-    # Split into ongoing (successful) and stopped (failed) experiments
-    df_successes = df[~df["next_evaluation_unixtime"].isna()]
-    df_failures = df[df["next_evaluation_unixtime"].isna()]
 
-    # Visualize record lifetime for successes
-    f, ax = plt.subplots()
+def plot_lifetimes(df: pd.DataFrame, title: str, path: Path):
+    lifetimes_d = df["lifetime_d"].to_numpy()
+    is_valid = ~np.isnan(lifetimes_d)
+    num_valid = np.count_nonzero(is_valid)
+    # Skip the whole figure pipeline if there is nothing to plot, and remove
+    # the figure of a previous run so it does not show outdated counts
+    if num_valid == 0:
+        path.unlink(missing_ok=True)
+        return
+
+    f, ax = plt.subplots(layout="constrained")
     bins = np.arange(
-        math.floor(df_successes["lifetime_d"].dropna().min()),
-        math.ceil(df_successes["lifetime_d"].dropna().max()) + 1,
-        1,
+        np.floor(np.nanmin(lifetimes_d)),
+        np.ceil(np.nanmax(lifetimes_d)) + 1,
+        1.0,
     )
-    for time_interval, group in df_successes.groupby("evaluation_time_interval_h"):
-        if len(group["lifetime_d"].dropna()) == 0:
+    groups = df.groupby("evaluation_time_interval_h").indices
+    for time_interval, group in groups.items():
+        group_lifetimes_d = lifetimes_d[group[is_valid[group]]]
+        if group_lifetimes_d.size == 0:
             continue
-        ax.hist(
-            group["lifetime_d"],
-            bins=bins,
+        counts, _ = np.histogram(group_lifetimes_d, bins=bins)
+        ax.stairs(
+            counts,
+            bins,
             label=f"{time_interval}h ({len(group)})",
             alpha=0.3,
+            fill=True,
         )
     ax.set_ylabel("Count")
     ax.set_xlabel("DHT record lifetime\n(days, 1 day bins)")
-    ax.set_title(
-        f"Successes ({len(df_successes["lifetime_d"].dropna())})\n"
-        "for different time intervals"
-    )
+    ax.set_title(f"{title} ({num_valid})\nfor different time intervals")
     ax.legend()
-    f.tight_layout()
-    f.savefig(out_directory / "lifetimes_successes.png")
-
-    # Visualize record lifetime for failures
-    if len(df_failures) > 0:
-        f, ax = plt.subplots()
-        bins = np.arange(
-            math.floor(df_failures["lifetime_d"].dropna().min()),
-            math.ceil(df_failures["lifetime_d"].dropna().max()) + 1,
-            1,
-        )
-        for time_interval, group in df_failures.groupby("evaluation_time_interval_h"):
-            if len(group["lifetime_d"].dropna()) == 0:
-                continue
-            ax.hist(
-                group["lifetime_d"],
-                bins=bins,
-                label=f"{time_interval}h ({len(group)})",
-                alpha=0.3,
-            )
-        ax.set_ylabel("Count")
-        ax.set_xlabel("DHT record lifetime\n(days, 1 day bins)")
-        ax.set_title(
-            f"Failures ({len(df_failures["lifetime_d"].dropna())})\n"
-            "for different time intervals"
-        )
-        ax.legend()
-        f.tight_layout()
-        f.savefig(out_directory / "lifetimes_failures.png")
+    f.savefig(path)
 
-    # Visualize payload size distributions for successes vs failures
-    f, ax = plt.subplots()
-    bins = range(0, math.ceil(df["payload_size_kib"].dropna().max()) + 1, 1)
-    ax.hist(
-        df_successes["payload_size_kib"],
-        bins=bins,
-        label=f"Successes ({len(df_successes)})",
+
+def plot_payload_sizes(df: pd.DataFrame, is_ongoing: np.ndarray, path: Path):
+    # Skip the whole figure pipeline if there is nothing to plot, and remove
+    # the figure of a previous run so it does not show outdated counts
+    if len(df) == 0:
+        path.unlink(missing_ok=True)
+        return
+
+    payload_sizes_kib = df["payload_size_kib"].to_numpy()
+    successes_kib = payload_sizes_kib[is_ongoing]
+    failures_kib = payload_sizes_kib[~is_ongoing]
+
+    f, ax = plt.subplots(layout="constrained")
+    max_payload_size_kib = np.ceil(np.nanmax(payload_sizes_kib))
+    bins = np.arange(0, max_payload_size_kib + 1, 1.0)
+    counts, _ = np.histogram(successes_kib, bins=bins)
+    ax.stairs(
+        counts,
+        bins,
+        label=f"Successes ({len(successes_kib)})",
         alpha=0.6,
+        fill=True,
     )
-    if len(df_failures) > 0:
-        ax.hist(
-            df_failures["payload_size_kib"],
-            bins=bins,
-            label=f"Failures ({len(df_failures)})",
+    if len(failures_kib) > 0:
+        counts, _ = np.histogram(failures_kib, bins=bins)
+        ax.stairs(
+            counts,
+            bins,
+            label=f"Failures ({len(failures_kib)})",
             alpha=0.6,
+            fill=True,
         )
     ax.set_ylabel("Count")
     ax.set_xlabel("Payload size\n(KiB, 1KiB bin size)")
     ax.set_title("Payload size\nsuccesses vs failures")
     ax.legend()
-    f.tight_layout()
-    f.savefig(out_directory / "payload_size_bs_success_vs_failure.png")
+    f.savefig(path)
+
+
+def main(stats_json_uri: str, out_directory: str):
+    # Initialize directory to save visualizations to
+    out_directory = Path(out_directory)
+    out_directory.mkdir(exist_ok=True)
+
+    # Load JSON, JSONL or Parquet with experimental results from HTTP or disk
+    if stats_json_uri.startswith("http"):
+        content = requests.get(stats_json_uri).content
+    else:
+        content = Path(stats_json_uri).read_bytes()
+    if stats_json_uri.endswith(".parquet"):
+        df = pd.read_parquet(io.BytesIO(content), columns=list(COLUMNS))
+    else:
+        if stats_json_uri.endswith(".jsonl"):
+            experiments = parse_experiments_log(content).values()
+        else:
+            experiments = orjson.loads(content).values()
+        df = pd.DataFrame(
+            {column: [e[column] for e in experiments] for column in COLUMNS},
+            copy=False,
+        )
+
+    # Calculate current experiment lifetime from first and last evaluation
+    # by flattening the ragged lists into contiguous arrays indexed by offsets
+    lengths = np.fromiter(
+        map(len, df["evaluation_start_unixtimes"]), dtype=np.int64, count=len(df)
+    )
+    ends = np.cumsum(lengths)
+    starts = np.fromiter(
+        itertools.chain.from_iterable(df["evaluation_start_unixtimes"]),
+        dtype=np.float64,
+    )
+    durations = np.fromiter(
+        itertools.chain.from_iterable(df["evaluation_durations_s"]),
+        dtype=np.float64,
+    )
+    has_two = lengths > 1
+    last = ends[has_two] - 1
+    first = ends[has_two] - lengths[has_two]
+    lifetime_s = np.full(len(df), np.nan)
+    lifetime_s[has_two] = starts[last] - starts[first] + durations[last]
+    df["lifetime_s"] = lifetime_s
+    df["lifetime_h"] = df["lifetime_s"] / 60 / 60
+    df["lifetime_d"] = df["lifetime_h"] / 24
+    df["payload_size_kib"] = df["payload_size_b"] / 1024
+
+    # Split into ongoing (successful) and stopped (failed) experiments
+    is_ongoing = df["next_evaluation_unixtime"].notna().to_numpy()
+    df_successes = df[is_ongoing]
+    df_failures = df[~is_ongoing]
+
+    # Visualize record lifetime for successes and failures
+    plot_lifetimes(df_successes, "Successes", out_directory / "lifetimes_successes.png")
+    plot_lifetimes(df_failures, "Failures", out_directory / "lifetimes_failures.png")
+
+    # Visualize payload size distributions for successes vs failures
+    plot_payload_sizes(
+        df, is_ongoing, out_directory / "payload_size_bs_success_vs_failure.png"
+    )
 
     print("done")
 
@@ -129,7 +179,7 @@ if __name__ == "__main__":
         nargs="?",
         type=str,
         default="http://65.108.215.98/veilid-dht-stats.json",
-        help="The URL or local file system path for the JSON results file.",
+        help="The URL or local file system path for the results file.",
     )
     parser.add_argument(
         "out_directory",
@@ -1,11 +1,11 @@
 import argparse
 import asyncio
-import json
 import os
 import random
 import time
 from pathlib import Path
 
+import orjson
 import veilid
 
 
@@ -13,33 +13,34 @@ async def simple_update_callback(update: veilid.VeilidUpdate):
     pass
 
 
-def generate_random_byte_string(min_length=1, max_length=32000):
-    # Generate a random length between min_length and max_length
-    length = random.randint(min_length, max_length)
+def generate_random_byte_strings(num, min_length=1, max_length=32000):
+    # Generate random bytes for all byte strings at once with a single syscall
+    pool = os.urandom(num * max_length)
 
-    # Generate a random byte string of the specified length
-    random_byte_string = os.urandom(length)
+    # Slice a byte string with a random length between min_length and max_length
+    # from each byte string's region of the pool
+    random_byte_strings = [
+        pool[i * max_length : i * max_length + random.randint(min_length, max_length)]
+        for i in range(num)
+    ]
 
-    return random_byte_string
+    return random_byte_strings
 
 
-async def create_experiment(rc) -> dict:
-    payload = generate_random_byte_string()
+async def create_experiment(rc, payload: bytes) -> dict:
+    record = await rc.create_dht_record(veilid.DHTSchema.dflt(1))
+    await rc.set_dht_value(record.key, veilid.ValueSubkey(0), payload)
 
-    async with rc:
-        record = await rc.create_dht_record(veilid.DHTSchema.dflt(1))
-        await rc.set_dht_value(record.key, veilid.ValueSubkey(0), payload)
+    # Wait for record to settle
+    while True:
+        report = await rc.inspect_dht_record(
+            record.key, subkeys=[], scope=veilid.types.DHTReportScope.LOCAL
+        )
+        if not report.offline_subkeys:
+            break
+        await asyncio.sleep(1)
 
-        # Wait for record to settle
-        while True:
-            report = await rc.inspect_dht_record(
-                record.key, subkeys=[], scope=veilid.types.DHTReportScope.LOCAL
-            )
-            if not report.offline_subkeys:
-                break
-            time.sleep(1)
-
-        await rc.close_dht_record(record.key)
+    await rc.close_dht_record(record.key)
 
     return {
         "payload_size_b": len(payload),
@@ -51,35 +52,105 @@ async def create_experiment(rc) -> dict:
     }
 
 
+def parse_experiments_log(log: bytes) -> dict:
+    # Later records in the append-only log supersede earlier ones, and a final
+    # record without a trailing newline was torn by a crash mid-append
+    experiments = {}
+    for record in log.split(b"\n")[:-1]:
+        e = orjson.loads(record)
+        experiments[e["dht_record_key"]] = e
+    return experiments
+
+
+def load_experiments(result: Path) -> dict:
+    if not result.exists():
+        return {}
+    if result.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        return {e["dht_record_key"]: e for e in pq.read_table(result).to_pylist()}
+    if result.suffix == ".jsonl":
+        return parse_experiments_log(result.read_bytes())
+    return orjson.loads(result.read_bytes())
+
+
+def save_experiments(result: Path, experiments: dict, changed_experiments: list):
+    if result.suffix == ".parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema(
+            [
+                ("dht_record_key", pa.string()),
+                ("payload_size_b", pa.int64()),
+                ("evaluation_time_interval_h", pa.int32()),
+                ("next_evaluation_unixtime", pa.float64()),
+                ("evaluation_start_unixtimes", pa.list_(pa.float64())),
+                ("evaluation_durations_s", pa.list_(pa.float64())),
+                ("exception", pa.string()),
+            ]
+        )
+        table = pa.Table.from_pylist(list(experiments.values()), schema=schema)
+        pq.write_table(table, result, compression="zstd")
+        return
+    if result.suffix == ".jsonl":
+        log = result.read_bytes() if result.exists() else b""
+        # Only append the experiments that changed during this run, after
+        # cutting off a final record torn by a crash mid-append
+        with result.open("ab") as f:
+            f.truncate(log.rfind(b"\n") + 1)
+            f.writelines(
+                orjson.dumps(e, option=orjson.OPT_APPEND_NEWLINE)
+                for e in changed_experiments
+            )
+        # Compact the log once superseded records outnumber the current ones
+        num_records = log.count(b"\n") + len(changed_experiments)
+        if num_records > 2 * len(experiments):
+            compacted = result.with_suffix(".jsonl.tmp")
+            compacted.write_bytes(
+                b"".join(
+                    orjson.dumps(e, option=orjson.OPT_APPEND_NEWLINE)
+                    for e in experiments.values()
+                )
+            )
+            compacted.replace(result)
+        return
+    result.write_bytes(orjson.dumps(experiments))
+
+
+async def bounded(semaphore: asyncio.Semaphore, coro):
+    async with semaphore:
+        return await coro
+
+
 async def run_experiment(rc, experiment: dict) -> dict:
-    exp = experiment.copy()
     start_evaluation = time.time()
     try:
-        async with rc:
-            record = await rc.open_dht_record(exp["dht_record_key"])
-            content = await rc.get_dht_value(
-                record.key, veilid.ValueSubkey(0), force_refresh=True
-            )
-            await rc.close_dht_record(record.key)
-            exp["next_evaluation_unixtime"] += (
-                exp["evaluation_time_interval_h"] * 60 * 60
+        record = await rc.open_dht_record(experiment["dht_record_key"])
+        content = await rc.get_dht_value(
+            record.key, veilid.ValueSubkey(0), force_refresh=True
+        )
+        await rc.close_dht_record(record.key)
+        experiment["next_evaluation_unixtime"] += (
+            experiment["evaluation_time_interval_h"] * 60 * 60
+        )
+        if experiment["payload_size_b"] != len(content.data):
+            raise ValueError(
+                f"Expected payload size {experiment["payload_size_b"]} "
+                f"but got {len(content.data)}"
             )
-            if exp["payload_size_b"] != len(content.data):
-                raise ValueError(
-                    f"Expected payload size {exp["payload_size_b"]} "
-                    f"but got {len(content.data)}"
-                )
     except Exception as e:
-        exp["exception"] = str(e)
-        exp["next_evaluation_unixtime"] = None
-    exp["evaluation_start_unixtimes"].append(start_evaluation)
-    exp["evaluation_durations_s"].append(time.time() - start_evaluation)
-    return exp
+        experiment["exception"] = str(e)
+        experiment["next_evaluation_unixtime"] = None
+    experiment["evaluation_start_unixtimes"].append(start_evaluation)
+    experiment["evaluation_durations_s"].append(time.time() - start_evaluation)
+    return experiment
 
 
 async def main(result: Path):
     num_max_experiments = 100
-    experiments = json.loads(result.read_text()) if result.exists() else {}
+    num_max_concurrent_experiments = 16
+    experiments = load_experiments(result)
 
     try:
         api = await veilid.api_connector(simple_update_callback)
@@ -94,6 +165,7 @@ async def main(result: Path):
         await api.debug("record purge remote")
 
         rc = await api.new_routing_context()
+        semaphore = asyncio.Semaphore(num_max_concurrent_experiments)
         async with rc:
             # Select all experiments that are due for evaluation
             pending_experiments = {
@@ -102,23 +174,25 @@ async def main(result: Path):
                 if v["next_evaluation_unixtime"] is not None
                 and v["next_evaluation_unixtime"] < time.time()
             }
-            # Run those pending experiments and update their data
+            # Run those pending experiments, which update their data in place
             updated_experiments = await asyncio.gather(
-                *[run_experiment(rc, e) for e in pending_experiments.values()]
+                *[
+                    bounded(semaphore, run_experiment(rc, e))
+                    for e in pending_experiments.values()
+                ]
             )
-            for e in updated_experiments:
-                experiments[e["dht_record_key"]] = e
 
-            # Select all experiments that have not ended
-            active_experiments = [
-                e
+            # Count all experiments that have not ended
+            num_active_experiments = sum(
+                1
                 for e in experiments.values()
                 if e["next_evaluation_unixtime"] is not None
-            ]
+            )
             # Ensure that the maxmimum number of experiments are running by adding more
-            num_new_experiments = max(0, num_max_experiments - len(active_experiments))
+            num_new_experiments = max(0, num_max_experiments - num_active_experiments)
+            payloads = generate_random_byte_strings(num_new_experiments)
             new_experiments = await asyncio.gather(
-                *[create_experiment(rc) for _ in range(num_new_experiments)]
+                *[bounded(semaphore, create_experiment(rc, p)) for p in payloads]
             )
             for e in new_experiments:
                 experiments[e["dht_record_key"]] = e
@@ -127,7 +201,7 @@ async def main(result: Path):
         await api.debug("record purge local")
         await api.debug("record purge remote")
 
-    result.write_text(json.dumps(experiments))
+    save_experiments(result, experiments, [*updated_experiments, *new_experiments])
 
 
 if __name__ == "__main__":
@@ -139,7 +213,7 @@ if __name__ == "__main__":
         nargs="?",
         type=str,
         default="/var/www/html/veilid-dht-stats.json",
-        help="The target path for the JSON results file.",
+        help="The target path for the JSON, JSONL or Parquet results file.",
     )
     args = parser.parse_args()
 